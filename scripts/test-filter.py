@@ -23,16 +23,20 @@ Examples:
 import argparse
 import os
 import re
+import signal
 import subprocess
 import sys
 import tempfile
+from typing import Optional
+
+# dealer3 repo root (this script lives in scripts/)
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_PARENT = os.path.dirname(_HERE)
 
 # Add Practice-Bidding-Scenarios build-scripts-mac to path for ssh_runner
-PBS_BUILD_SCRIPTS = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-    "..", "Practice-Bidding-Scenarios", "build-scripts-mac"
-)
-PBS_BUILD_SCRIPTS = os.path.normpath(PBS_BUILD_SCRIPTS)
+PBS_BUILD_SCRIPTS = os.path.normpath(os.path.join(
+    _PARENT, "..", "Practice-Bidding-Scenarios", "build-scripts-mac"
+))
 
 if not os.path.isdir(PBS_BUILD_SCRIPTS):
     print(f"Error: Cannot find PBS build-scripts-mac at {PBS_BUILD_SCRIPTS}")
@@ -41,21 +45,143 @@ if not os.path.isdir(PBS_BUILD_SCRIPTS):
 
 sys.path.insert(0, PBS_BUILD_SCRIPTS)
 
-from ssh_runner import run_windows_command, mac_to_windows_path
+# Deal-counting patterns for dealer.exe output
+_PRINTALL_RE = re.compile(r'^\s*\d+\.\s*$', re.MULTILINE)
+_ONELINE_RE = re.compile(r'^[nesw] ', re.MULTILINE)
+
+# .dlr action-line patterns
+_PRINT_ACTIONS = r'printall|printew|printpbn|printcompact|printoneline'
+_ACTION_LINE_RE = re.compile(r'^action\b(?P<rest>.*)$', re.MULTILINE)
+_PRINT_TOKEN_RE = re.compile(rf'\b({_PRINT_ACTIONS})\b')
+
+# Characters dealer.exe's block comment bug echoes ahead of its output
+_EOF_ECHO_CHARS = '<EOF>'
+
+# Pipe buffer size for draining multi-MB dealer output
+_PIPE_BUFSIZE = 1 << 16
+
+# Build inputs cargo's dep-info doesn't list, relative to the dealer3 root
+_BUILD_MANIFESTS = (
+    "Cargo.toml",
+    "Cargo.lock",
+    os.path.join("dealer", "Cargo.toml"),
+)
+
+# Tokens of a cargo dep-info (.d) line and the escapes inside them
+_DEP_INFO_TOKEN_RE = re.compile(r'(?:\\.|[^\s\\])+')
+_DEP_INFO_ESCAPE_RE = re.compile(r'\\(.)')
+
+# dealer3 verbose statistics
+_GENERATED_RE = re.compile(rb'Generated\s+(\d+)')
+_PRODUCED_RE = re.compile(rb'Produced\s+(\d+)')
 
 
 def count_printall_deals(text: str) -> int:
     """Count deals in printall format output (board number lines like '   1.')."""
-    return len(re.findall(r'^\s*\d+\.\s*$', text, re.MULTILINE))
+    return len(_PRINTALL_RE.findall(text))
 
 
 def count_oneline_deals(text: str) -> int:
     """Count deals in oneline format output (lines starting with compass letter)."""
-    return len(re.findall(r'^[nesw] ', text, re.MULTILINE))
+    return len(_ONELINE_RE.findall(text))
+
+
+def head_lines(text: str, n: int) -> list[str]:
+    """Return the first n lines of text without splitting the rest of it."""
+    parts = text.split('\n', n)
+    if len(parts) <= n and parts[-1] == '':
+        # Trailing newline (or empty text), not a real line
+        parts.pop()
+    return [part.rstrip('\r') for part in parts[:n]]
+
 
+def newest_build_input_mtime(dealer3_root: str,
+                             dealer3_bin: str) -> Optional[float]:
+    """Return the newest mtime of the files cargo built dealer3_bin from.
 
-def prepare_dlr_with_printall(dlr_file: str) -> str:
-    """Create a temp copy of the .dlr file with 'action printall' forced.
+    Reads cargo's dep-info file (dealer3_bin + '.d'), which lists exactly
+    the sources compiled into the binary, and adds the manifests and lock
+    file that dep-info leaves out (profiles, features, dependency
+    versions). Returns None when the dep-info file is missing or names a
+    file that no longer exists, meaning a rebuild is needed.
+    """
+    try:
+        with open(dealer3_bin + ".d") as f:
+            line = f.readline()
+    except OSError:
+        return None
+
+    # 'target: dep dep ...', with spaces in paths escaped as '\ '
+    deps = [_DEP_INFO_ESCAPE_RE.sub(r'\1', token)
+            for token in _DEP_INFO_TOKEN_RE.findall(line)[1:]]
+    if not deps:
+        return None
+    try:
+        newest = max(os.path.getmtime(dep) for dep in deps)
+    except OSError:
+        return None
+
+    # Cargo.lock is not checked in, so a manifest may legitimately be absent
+    for manifest in _BUILD_MANIFESTS:
+        path = os.path.join(dealer3_root, manifest)
+        if os.path.isfile(path):
+            newest = max(newest, os.path.getmtime(path))
+    return newest
+
+
+def start_dealer3_build(
+    dealer3_root: str,
+) -> tuple[str, Optional[subprocess.Popen]]:
+    """Start a release build of dealer3 if missing or older than its inputs.
+
+    When the binary is up to date this skips cargo's own (much slower)
+    staleness check entirely. Returns (binary path, running cargo process
+    or None if no build was needed). Finish with finish_dealer3_build().
+    """
+    dealer3_bin = os.path.join(dealer3_root, "target", "release", "dealer")
+    if os.path.isfile(dealer3_bin):
+        newest_input = newest_build_input_mtime(dealer3_root, dealer3_bin)
+        if (newest_input is not None and
+                os.path.getmtime(dealer3_bin) >= newest_input):
+            return dealer3_bin, None
+
+    # Own session so an early exit can stop cargo together with its rustc
+    # children (see abort_dealer3_build)
+    build = subprocess.Popen(
+        ["cargo", "build", "--release", "--bin", "dealer", "-q"],
+        cwd=dealer3_root,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    return dealer3_bin, build
+
+
+def finish_dealer3_build(dealer3_bin: str, build: subprocess.Popen) -> None:
+    """Wait for a build started by start_dealer3_build() to finish.
+
+    Raises subprocess.CalledProcessError if cargo fails.
+    """
+    if build.wait() != 0:
+        raise subprocess.CalledProcessError(build.returncode, build.args)
+    # cargo may decide the binary is fresh without relinking it; touch it
+    # so the next run's check passes instead of starting cargo every time
+    os.utime(dealer3_bin)
+
+
+def abort_dealer3_build(build: Optional[subprocess.Popen]) -> None:
+    """Stop a background build (if any) before an early exit."""
+    if build is None or build.poll() is not None:
+        return
+    try:
+        os.killpg(build.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    build.wait()
+
+
+def prepare_dlr_with_printall(dlr_file: str) -> tuple[str, bool]:
+    """Return a .dlr file path with 'action printall' forced.
 
     Some .dlr files have 'action' with no format or a non-deal action,
     so dealer.exe only outputs statistics. We need printall output to
@@ -66,45 +192,44 @@ def prepare_dlr_with_printall(dlr_file: str) -> str:
     - File has 'action' with averages/frequencies but no print → insert printall
     - File has no action line at all → append 'action printall'
 
-    Returns the path to the temp file (caller must delete it).
+    Returns (path, is_temp). When the file already has a print action the
+    original path is returned unchanged; otherwise a modified temp copy is
+    written and is_temp is True (caller must delete it).
     """
     with open(dlr_file, "r") as f:
         content = f.read()
 
-    print_actions = r'printall|printew|printpbn|printcompact|printoneline'
-    has_print = re.search(
-        rf'^action\b.*\b({print_actions})\b', content, re.MULTILINE
-    )
-
-    if not has_print:
-        # Check if 'action' is alone on a line (multi-line action block
-        # with averages/frequencies on following lines)
-        bare_action = re.search(r'^action\s*$', content, re.MULTILINE)
-        if bare_action:
-            # Insert 'printall,' so averages/frequencies still chain
-            content = re.sub(
-                r'^action\s*$', 'action printall,',
-                content, flags=re.MULTILINE, count=1
-            )
-        elif re.search(r'^action\b', content, re.MULTILINE):
+    # Locate the action line once, then classify it by what follows
+    # 'action' on that line
+    action = _ACTION_LINE_RE.search(content)
+    if action is None:
+        # No action line at all
+        content = content.rstrip() + '\naction printall\n'
+    else:
+        rest_start, rest_end = action.span('rest')
+        if _PRINT_TOKEN_RE.search(content, rest_start, rest_end):
+            return dlr_file, False
+
+        rest = action.group('rest').strip()
+        if not rest:
+            # 'action' alone on a line (multi-line action block with
+            # averages/frequencies on following lines) — insert 'printall,'
+            # so they still chain
+            new_line = 'action printall,'
+        else:
             # Action with components on same line but no print type —
             # prepend printall to the component list
-            content = re.sub(
-                r'^action\b\s*', 'action printall, ',
-                content, flags=re.MULTILINE, count=1
-            )
-        else:
-            # No action line at all
-            content = content.rstrip() + '\naction printall\n'
+            new_line = f'action printall, {rest}'
+        content = content[:action.start()] + new_line + content[rest_end:]
 
     # Write to a temp file in the same directory (so the Windows path
     # mapping works — the file must be under the GitHub folder)
     dlr_dir = os.path.dirname(dlr_file)
     fd, tmp_path = tempfile.mkstemp(suffix=".dlr", dir=dlr_dir)
-    with os.fdopen(fd, "w") as f:
-        f.write(content)
+    with os.fdopen(fd, "wb") as f:
+        f.write(content.encode())
 
-    return tmp_path
+    return tmp_path, True
 
 
 def main():
@@ -126,100 +251,128 @@ def main():
         print(f"Error: File not found: {dlr_file}", file=sys.stderr)
         sys.exit(1)
 
+    # Imported lazily so --help and argument errors don't pay for loading
+    # the SSH stack
+    from ssh_runner import run_windows_command, mac_to_windows_path
+
     scenario = os.path.splitext(os.path.basename(dlr_file))[0]
-    dealer3_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    dealer3_root = _PARENT
+
+    # Buffer stdout even on a terminal and flush only before the slow
+    # steps, so the status lines go out in a few writes instead of one per
+    # print. Errors below go to stderr right after a flush, keeping order.
+    sys.stdout.reconfigure(line_buffering=False)
 
     print(f"=== Test Filter: {scenario} ===")
     print()
 
     # --- Step 1: Generate deals with Windows dealer.exe ---
     print(f"Step 1: Generating {args.produce} deals with dealer.exe "
-          f"(seed={args.seed})...")
+          f"(seed={args.seed})...", flush=True)
 
-    # Create temp .dlr with 'action printall' to ensure deals are output
-    tmp_dlr = prepare_dlr_with_printall(dlr_file)
+    # Check/build dealer3 in the background while dealer.exe runs over SSH
+    dealer3_bin, build = start_dealer3_build(dealer3_root)
+    if build is not None:
+        print("  Building dealer3 (release) in the background...", flush=True)
 
+    # Until the build has finished, stop it on any failure (including
+    # sys.exit and Ctrl-C, which never reaches cargo's own session)
     try:
-        win_dlr_path = mac_to_windows_path(tmp_dlr)
-        # dealer.exe is in PATH on Windows (C:\Dealer\dealer.exe)
-        dealer_cmd = (
-            f'dealer -p {args.produce} -s {args.seed} "{win_dlr_path}"'
-        )
+        # Force 'action printall' (via a temp .dlr if needed) so deals are
+        # output
+        exe_dlr, exe_dlr_is_temp = prepare_dlr_with_printall(dlr_file)
 
         try:
-            returncode, stdout, stderr = run_windows_command(
-                dealer_cmd, timeout=120, verbose=False
+            win_dlr_path = mac_to_windows_path(exe_dlr)
+            # dealer.exe is in PATH on Windows (C:\Dealer\dealer.exe)
+            dealer_cmd = (
+                f'dealer -p {args.produce} -s {args.seed} "{win_dlr_path}"'
             )
-        except Exception as e:
-            print(f"  ERROR: dealer.exe failed: {e}", file=sys.stderr)
-            sys.exit(1)
-    finally:
-        os.unlink(tmp_dlr)
-
-    if returncode != 0:
-        print(f"  ERROR: dealer.exe exited with code {returncode}",
-              file=sys.stderr)
-        if stderr:
-            print(f"  stderr: {stderr.strip()}", file=sys.stderr)
-        sys.exit(1)
-
-    dealer_exe_output = stdout
 
-    # Strip stray characters from dealer.exe block comment bug.
-    # The bug echoes <, E, O, F, > characters from inside /* */ comments.
-    if dealer_exe_output and dealer_exe_output[0] in '<EOF>':
-        dealer_exe_output = dealer_exe_output.lstrip('<EOF>')
+            try:
+                returncode, stdout, stderr = run_windows_command(
+                    dealer_cmd, timeout=120, verbose=False
+                )
+            except Exception as e:
+                print(f"  ERROR: dealer.exe failed: {e}", file=sys.stderr)
+                sys.exit(1)
+        finally:
+            if exe_dlr_is_temp:
+                os.unlink(exe_dlr)
+
+        if returncode != 0:
+            print(f"  ERROR: dealer.exe exited with code {returncode}",
+                  file=sys.stderr)
+            if stderr:
+                print(f"  stderr: {stderr.strip()}", file=sys.stderr)
+            sys.exit(1)
 
-    # Count deals from dealer.exe output
-    deals_from_exe = (count_printall_deals(dealer_exe_output) +
-                      count_oneline_deals(dealer_exe_output))
+        # Strip stray characters from dealer.exe block comment bug. The
+        # bug echoes <, E, O, F, > characters from inside /* */ comments.
+        # lstrip stops at the first other character and returns the string
+        # itself when there is nothing to strip.
+        dealer_exe_output = stdout.lstrip(_EOF_ECHO_CHARS)
+
+        # Count deals from dealer.exe output. Usually printall was forced,
+        # but a .dlr that already has its own print action (printoneline,
+        # printew, ...) is passed through unchanged, so fall back to
+        # counting oneline deals when no printall boards are found.
+        deals_from_exe = (count_printall_deals(dealer_exe_output) or
+                          count_oneline_deals(dealer_exe_output))
+
+        if deals_from_exe == 0:
+            print("  ERROR: dealer.exe produced 0 deals!")
+            print("  Raw output (first 10 lines):")
+            for line in head_lines(dealer_exe_output, 10):
+                print(f"    {line}")
+            sys.exit(1)
 
-    if deals_from_exe == 0:
-        print("  ERROR: dealer.exe produced 0 deals!")
-        print("  Raw output (first 10 lines):")
-        for line in dealer_exe_output.splitlines()[:10]:
-            print(f"    {line}")
-        sys.exit(1)
+        print(f"  dealer.exe produced {deals_from_exe} deals")
 
-    print(f"  dealer.exe produced {deals_from_exe} deals")
+        # --- Step 2: Feed deals through dealer3 with same filter ---
+        print()
+        print(f"Step 2: Feeding {deals_from_exe} deals through dealer3 "
+              f"filter...", flush=True)
 
-    # --- Step 2: Feed deals through dealer3 with same filter ---
-    print()
-    print(f"Step 2: Feeding {deals_from_exe} deals through dealer3 filter...")
+        if build is not None:
+            print("  Waiting for dealer3 build...", flush=True)
+            finish_dealer3_build(dealer3_bin, build)
+    except BaseException:
+        abort_dealer3_build(build)
+        raise
 
-    # Build dealer3 if needed
-    dealer3_bin = os.path.join(dealer3_root, "target", "release", "dealer")
-    if not os.path.isfile(dealer3_bin):
-        print("  Building dealer3 (release)...")
-        subprocess.run(
-            ["cargo", "build", "--release", "--bin", "dealer", "-q"],
-            cwd=dealer3_root,
-            check=True,
-            capture_output=True,
-        )
-
-    # Write dealer.exe output to temp file for --input-deals
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".txt", delete=False
-    ) as tmp:
-        tmp.write(dealer_exe_output)
+    # Write dealer.exe output (encoded once, as bytes) to a temp file for
+    # --input-deals
+    with tempfile.NamedTemporaryFile(suffix=".txt", delete=False) as tmp:
+        tmp.write(dealer_exe_output.encode())
         tmp_path = tmp.name
 
+    # Read dealer3's output line by line, picking out the stats as they
+    # arrive. The pipe stays binary so the output is never decoded
+    # wholesale; only the lines -v may need to show are kept and decoded.
+    generated_match = None
+    produced_match = None
+    dealer3_lines = []
     try:
-        result = subprocess.run(
+        with subprocess.Popen(
             [dealer3_bin, "--input-deals", tmp_path, "-v", "-f", "oneline",
              dlr_file],
-            capture_output=True,
-            text=True,
-        )
-        dealer3_output = result.stdout + result.stderr
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=_PIPE_BUFSIZE,
+        ) as proc:
+            for line in proc.stdout:
+                if args.verbose:
+                    dealer3_lines.append(
+                        line.rstrip(b"\r\n").decode(errors="replace")
+                    )
+                if generated_match is None:
+                    generated_match = _GENERATED_RE.search(line)
+                if produced_match is None:
+                    produced_match = _PRODUCED_RE.search(line)
     finally:
         os.unlink(tmp_path)
 
-    # Extract stats from dealer3 output
-    generated_match = re.search(r'Generated\s+(\d+)', dealer3_output)
-    produced_match = re.search(r'Produced\s+(\d+)', dealer3_output)
-
     generated = int(generated_match.group(1)) if generated_match else 0
     produced = int(produced_match.group(1)) if produced_match else 0
 
@@ -238,11 +391,11 @@ def main():
         if args.verbose:
             print()
             print("--- Dealer.exe output (first 30 lines) ---")
-            for line in dealer_exe_output.splitlines()[:30]:
+            for line in head_lines(dealer_exe_output, 30):
                 print(f"  {line}")
             print()
             print("--- Dealer3 output ---")
-            for line in dealer3_output.splitlines():
+            for line in dealer3_lines:
                 print(f"  {line}")
 
         sys.exit(1)
@@ -89,7 +89,11 @@ while [[ $# -gt 0 ]]; do
 done
 
 # Build the SSH command
+# Share one master connection across invocations (ControlPersist keeps it
+# alive for 60s) so back-to-back runs skip the TCP + auth handshake. The
+# socket lives under the user's own ~/.ssh (ssh expands the ~), not /tmp.
 SSH_OPTS="-o ConnectTimeout=5 -o BatchMode=yes"
+SSH_OPTS+=" -o ControlMaster=auto -o ControlPath=~/.ssh/cm-%C -o ControlPersist=60s"
 
 # Map G: drive to GitHub folder (must be done each SSH session)
 # Parallels maps \\Mac\Home to macOS $HOME, so strip $HOME prefix